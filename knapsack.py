@@ -4,39 +4,27 @@ Date: 20171019
 Description:
     Usage of context managers for structured modelling with gurobi
 """
+import math
+import operator
 import sys
 
-from collections import OrderedDict
-from functools import reduce
+from functools import partial
 from typing import List
 
 import gurobipy
 
 
-def merge_dicts(a, b):
-    merged = OrderedDict()
-    for key, val in a.items():
-        if key not in b:
-            merged[key] = val
-        else:
-            if isinstance(val, dict) and isinstance(b[key], dict):
-                merged[key] = merge_dicts(a[key], b[key])
-            else:
-                raise RuntimeError('Error merging {a} and {b}')
-    for key, val in b.items():
-        if key in merged:
-            continue
-        merged[key] = val
-    return merged
-
-
 class Carrier:
+    __slots__ = ('name', 'weight')
+
     def __init__(self, name, weight_capacity):
         self.name = name
         self.weight = weight_capacity
 
 
 class Bag:
+    __slots__ = ('name', 'volume', 'weight')
+
     def __init__(self, name, volume_capacity, weight_capacity):
         self.name = name
         self.volume = volume_capacity
@@ -44,6 +32,8 @@ class Bag:
 
 
 class Item:
+    __slots__ = ('name', 'volume', 'weight', 'value', 'available', 'requirement')
+
     def __init__(self, name, volume_requirement, weight_requirement, value, available_count=2**31, requirement=0):
         self.name = name
         self.volume = volume_requirement
@@ -53,19 +43,76 @@ class Item:
         self.requirement = requirement
 
 
+def count_that_fits(weight_capacity, volume_capacity, weight, volume, limit):
+    """
+    Returns how many units of the given weight and volume fit within the capacities, at most limit.
+    A small tolerance keeps exact fits such as 1.0 / 0.1 from rounding down; an infinite capacity imposes no limit.
+    """
+    count = limit
+    for capacity, size in ((weight_capacity, weight), (volume_capacity, volume)):
+        if size > 0:
+            ratio = capacity / size
+            if math.isfinite(ratio):
+                count = min(count, int(ratio + 1e-9))
+    return count
+
+
+def max_counts_in_bags(bags: List[Bag], items: List[Item]):
+    """
+    Returns how many of each item fit in each bag by weight, volume and availability,
+    as one row per bag aligned with items.
+    """
+    weights = [item.weight for item in items]
+    volumes = [item.volume for item in items]
+    available = [item.available for item in items]
+    return [[count_that_fits(bag.weight, bag.volume, weight, volume, limit)
+             for weight, volume, limit in zip(weights, volumes, available)]
+            for bag in bags]
+
+
+def greedy_packing(bags: List[Bag], items: List[Item]):
+    """
+    Packs the bags greedily, required items first and then by value per unit of weight or volume.
+    Returns the count of each item in each bag keyed by (bag name, item name), intended as a MIP start.
+    The carrier's capacity is not considered; gurobi discards the start if it turns out infeasible.
+    """
+    packing = {(bag.name, item.name): 0 for bag in bags for item in items}
+    packed = {item.name: 0 for item in items}
+    weight_left = {bag.name: bag.weight for bag in bags}
+    volume_left = {bag.name: bag.volume for bag in bags}
+
+    def pack(item, target):
+        for bag in bags:
+            count = count_that_fits(weight_left[bag.name], volume_left[bag.name],
+                                    item.weight, item.volume, target - packed[item.name])
+            if count <= 0:
+                continue
+            packing[bag.name, item.name] += count
+            packed[item.name] += count
+            weight_left[bag.name] -= count * item.weight
+            volume_left[bag.name] -= count * item.volume
+
+    def density(item):
+        size = max(item.weight, item.volume)
+        return item.value / size if size > 0 else float('inf')
+
+    for item in items:
+        if item.requirement > 0:
+            pack(item, item.requirement)
+    for item in sorted(items, key=density, reverse=True):
+        pack(item, item.available)
+    return packing
+
+
 class Vars:
     def __init__(self, model, *args, **kwargs):
-        self._vars = OrderedDict()
+        self._vars = {}
         self.model = model
 
     @property
     def vars(self):
         return self._vars
 
-    @vars.setter
-    def set_vars(self, v):
-        self._vars = merge_dicts(self._vars, v)
-
     def __enter__(self):
         return self
 
@@ -76,13 +123,7 @@ class Vars:
 class Constraints(Vars):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.constraints = OrderedDict()
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, a, b, c):
-        pass
+        self.constraints = {}
 
 
 class BagVars(Vars):
@@ -92,15 +133,13 @@ class BagVars(Vars):
 
     def __enter__(self):
         super().__enter__()
-        for bag in self.bags:
-            self.vars[bag.name] = OrderedDict()
-            self.vars[bag.name]['weight'] = self.model.addVar(vtype=gurobipy.GRB.CONTINUOUS, lb=0, ub=bag.weight, name=f'Bag({bag.name})_weight')
-            self.vars[bag.name]['volume'] = self.model.addVar(vtype=gurobipy.GRB.CONTINUOUS, lb=0, ub=bag.volume, name=f'Bag({bag.name})_volume')
+        names = [bag.name for bag in self.bags]
+        self.bag_weight = self.model.addVars(names, vtype=gurobipy.GRB.CONTINUOUS, lb=0, ub={bag.name: bag.weight for bag in self.bags}, name='Bag_weight')
+        self.bag_volume = self.model.addVars(names, vtype=gurobipy.GRB.CONTINUOUS, lb=0, ub={bag.name: bag.volume for bag in self.bags}, name='Bag_volume')
+        for name in names:
+            self.vars[name] = {'weight': self.bag_weight[name], 'volume': self.bag_volume[name]}
         return self
 
-    def __exit__(self, a, b, c):
-        super().__exit__(a, b, c)
-
 
 class ItemVars(Vars):
     def __init__(self, items, *args,  **kwargs):
@@ -109,159 +148,129 @@ class ItemVars(Vars):
 
     def __enter__(self):
         super().__enter__()
-        for item in self.items:
-            self.vars[item.name] = OrderedDict()
-            self.vars[item.name]['count'] = self.model.addVar(vtype=gurobipy.GRB.INTEGER, lb=0, ub=item.available, name=f'Item({item.name})_count')
+        names = [item.name for item in self.items]
+        self.item_count = self.model.addVars(names, vtype=gurobipy.GRB.INTEGER, lb=0, ub={item.name: item.available for item in self.items}, name='Item_count')
+        # Aligned with self.items, so the builders can index by position instead of by name
+        self._item_count_vars = list(self.item_count.values())
+        for name in names:
+            self.vars[name] = {'count': self.item_count[name]}
         return self
 
-    def __exit__(self, a, b, c):
-        super().__exit__(a, b, c)
-
 
 class ItemsInBagVars(BagVars, ItemVars):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
     def __enter__(self):
         super().__enter__()
-        for bag in self.bags:
-            for item in self.items:
-                if item.name not in self.vars[bag.name]:
-                    self.vars[bag.name][item.name] = OrderedDict()
-                self.vars[bag.name][item.name]['count'] = self.model.addVar(vtype=gurobipy.GRB.INTEGER, lb=0, ub=item.available, name=f'Item({item.name})_count_in_Bag({bag.name})')
+        # Aligned with self._in_bag_vars
+        self._max_in_bag = max_counts_in_bags(self.bags, self.items)
+        max_count = {(bag.name, item.name): count
+                     for bag, row in zip(self.bags, self._max_in_bag)
+                     for item, count in zip(self.items, row)}
+        self.item_in_bag_count = self.model.addVars(max_count.keys(), vtype=gurobipy.GRB.INTEGER, lb=0, ub=max_count, name='Item_count_in_Bag')
+        # One row per bag, aligned with self.items; keys were added bag by bag
+        in_bag = list(self.item_in_bag_count.values())
+        n_items = len(self.items)
+        self._in_bag_vars = [in_bag[b * n_items:(b + 1) * n_items] for b in range(len(self.bags))]
+        for (bag_name, item_name), var in self.item_in_bag_count.items():
+            bag_vars = self.vars[bag_name]
+            if item_name not in bag_vars:
+                bag_vars[item_name] = {}
+            bag_vars[item_name]['count'] = var
         return self
 
-    def __exit__(self, a, b, c):
-        super().__exit__(a, b, c)
-
 
 class CarrierConstraints(ItemVars, Constraints):
     def __init__(self, carrier: Carrier, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.carrier = carrier
 
+    def _total_weight_bounded_by(self, capacity):
+        # Overridden by constraints that already cap the total item weight
+        return False
+
     def __enter__(self):
         super().__enter__()
-        self.constraints[self.carrier.name] = OrderedDict()
-        weight_sum_expr = reduce(lambda a, b: a + b,
-                                 [self.vars[item.name]['count'] * item.weight
-                                  for item in self.items])
-        self.constraints[carrier.name]['weight'] = model.addConstr(weight_sum_expr <= self.carrier.weight)
+        self.constraints[self.carrier.name] = {}
+        # The row stays None when the rest of the model already implies it
+        if self._total_weight_bounded_by(self.carrier.weight):
+            self.constraints[self.carrier.name]['weight'] = None
+            return self
+        weight_sum_expr = gurobipy.LinExpr([item.weight for item in self.items], self._item_count_vars)
+        self.constraints[self.carrier.name]['weight'] = self.model.addConstr(weight_sum_expr <= self.carrier.weight)
         return self
 
-    def __exit__(self, a, b, c):
-        super().__exit__(a, b, c)
-
 
 class ItemInBagConstraints(ItemsInBagVars, Constraints):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def _total_weight_bounded_by(self, capacity):
+        # Every counted item is in some bag, so the total weight is at most the sum of bag weight capacities
+        return sum(bag.weight for bag in self.bags) <= capacity
 
     def __enter__(self):
         super().__enter__()
-        for bag in self.bags:
-            if bag.name not in self.constraints:
-                self.constraints[bag.name] = OrderedDict()
-            weight_sum_expr = reduce(lambda a, b: a + b,
-                                     [self.vars[bag.name][item.name][
-                                          'count'] * item.weight
-                                      for item in self.items])
-            self.constraints[bag.name][
-                'weight'] = model.addConstr(weight_sum_expr <= bag.weight)
-            volume_sum_expr = reduce(lambda a, b: a + b,
-                                     [self.vars[bag.name][item.name][
-                                          'count'] * item.volume
-                                      for item in self.items])
-            self.constraints[bag.name][
-                'volume'] = model.addConstr(volume_sum_expr <= bag.volume)
-
-        for item in self.items:
-            if item.name not in self.constraints:
-                self.constraints[item.name] = OrderedDict()
-            item_count = reduce(lambda a, b: a + b, [self.vars[bag.name][item.name]['count'] for bag in self.bags])
-            self.constraints[item.name]['total'] = model.addConstr(item_count == self.vars[item.name]['count'])
+        items, bags, constraints = self.items, self.bags, self.constraints
+        bag_names = [bag.name for bag in bags]
+        item_names = [item.name for item in items]
+        weights = [item.weight for item in items]
+        volumes = [item.volume for item in items]
+        ones = [1.0] * len(bags)
+        max_weight = {bag.name: bag.weight for bag in bags}
+        max_volume = {bag.name: bag.volume for bag in bags}
+        # Per-bag rows and per-item columns of the item-in-bag variables, keyed once for addConstrs
+        rows = dict(zip(bag_names, self._in_bag_vars))
+        columns = dict(zip(item_names, map(list, zip(*self._in_bag_vars))))
+        counts = dict(zip(item_names, self._item_count_vars))
+
+        weight_constrs = self.model.addConstrs((gurobipy.LinExpr(weights, rows[b]) <= max_weight[b] for b in bag_names), name='Bag_weight_capacity')
+        volume_constrs = self.model.addConstrs((gurobipy.LinExpr(volumes, rows[b]) <= max_volume[b] for b in bag_names), name='Bag_volume_capacity')
+        total_constrs = self.model.addConstrs((gurobipy.LinExpr(ones, columns[i]) == counts[i] for i in item_names), name='Item_total')
+        # An item's total can be no more than what fits in all bags combined
+        max_total = [min(item.available, sum(column)) for item, column in zip(items, zip(*self._max_in_bag))]
+        self.model.setAttr('UB', self._item_count_vars, max_total)
+        for name in bag_names:
+            constraints.setdefault(name, {}).update(weight=weight_constrs[name], volume=volume_constrs[name])
+        for name in item_names:
+            constraints.setdefault(name, {})['total'] = total_constrs[name]
         return self
 
-    def __exit__(self, a, b, c):
-        super().__exit__(a, b, c)
-
-
-class ItemRequirementConstraints(ItemVars):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
 
+class ItemRequirementConstraints(ItemVars, Constraints):
     def __enter__(self):
         super().__enter__()
-        for item in self.items:
-            if item.name not in self.constraints:
-                self.constraints[item.name] = OrderedDict()
-            self.constraints[item.name]['required'] = self.model.addConstr(self.vars[item.name]['count'] >= item.requirement)
-
-    def __exit__(self, a, b, c):
-        super().__exit__(a, b, c)
+        required = {item.name: item.requirement for item in self.items}
+        required_constrs = self.model.addConstrs((self.item_count[i] >= required[i] for i in required), name='Item_required')
+        for name, constr in required_constrs.items():
+            self.constraints.setdefault(name, {})['required'] = constr
+        return self
 
 
 # Modify the base model by removing constraints here
 class BaseModel(ItemInBagConstraints, CarrierConstraints, ItemRequirementConstraints):
-    pass
-
-
-class MaxVolumeGoal(BaseModel):
-    def __init__(self, *args, **kwargs):
-        super(MaxVolumeGoal, self).__init__(*args, **kwargs)
-
-    def __enter__(self):
-        super().__enter__()
-        volume_expr = reduce(lambda a, b: a + b,
-                                 [self.vars[item.name]['count'] * item.volume
-                                  for item in self.items])
-        self.model.setObjective(volume_expr, gurobipy.GRB.MAXIMIZE)
-        return self
-
-    def __exit__(self, a, b, c):
-        super().__exit__(a, b, c)
-
-
-class MaxValueGoal(BaseModel):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
     def __enter__(self):
         super().__enter__()
-        value_expr = reduce(lambda a, b: a + b,
-                                 [self.vars[item.name]['count'] * item.value
-                                  for item in self.items])
-        self.model.setObjective(value_expr, gurobipy.GRB.MAXIMIZE)
+        self.model.update()
         return self
 
-    def __exit__(self, a, b, c):
-        super().__exit__(a, b, c)
-
 
-class MaxWeightGoal(BaseModel):
-    def __init__(self, *args, **kwargs):
+class ObjectiveGoal(BaseModel):
+    def __init__(self, objective_attr, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.objective_attr = objective_attr
 
     def __enter__(self):
         super().__enter__()
-        weight_expr = reduce(lambda a, b: a + b,
-                                 [self.vars[item.name]['count'] * item.weight
-                                  for item in self.items])
-        self.model.setObjective(weight_expr, gurobipy.GRB.MAXIMIZE)
+        attr = operator.attrgetter(self.objective_attr)
+        objective_expr = gurobipy.LinExpr([attr(item) for item in self.items], self._item_count_vars)
+        self.model.setObjective(objective_expr, gurobipy.GRB.MAXIMIZE)
         return self
 
-    def __exit__(self, a, b, c):
-        super().__exit__(a, b, c)
-
 
 if __name__ == '__main__':
     if len(sys.argv) != 2 or sys.argv[1] not in ['volume', 'weight', 'value']:
         print('You must supply exactly one argument [volume, weight, value]')
         sys.exit(-1)
     conversion_map = {
-        'volume': MaxVolumeGoal,
-        'weight': MaxWeightGoal,
-        'value': MaxValueGoal
+        'volume': partial(ObjectiveGoal, 'volume'),
+        'weight': partial(ObjectiveGoal, 'weight'),
+        'value': partial(ObjectiveGoal, 'value')
     }
 
     carrier = Carrier('John', weight_capacity=200)
@@ -285,19 +294,24 @@ if __name__ == '__main__':
     model = gurobipy.Model()
     kwargs = {'carrier':carrier, 'bags':bags, 'items':items, 'model':model}
     with conversion_map[sys.argv[1]](**kwargs) as base:
+        start = greedy_packing(bags, items)
+        model.setAttr('Start', base.item_in_bag_count, start)
+        model.setAttr('Start', base.item_count, {item.name: sum(start[bag.name, item.name] for bag in bags) for item in items})
         model.optimize()
+        in_bag_count = model.getAttr('X', base.item_in_bag_count)
+        item_count = model.getAttr('X', base.item_count)
 
         print('\n=== Items brought ===\n')
         for bag in bags:
             print(f'---Items in {bag.name}---')
             for item in items:
-                if base.vars[bag.name][item.name]["count"].x > 0:
-                    print(f'{item.name}: {base.vars[bag.name][item.name]["count"].x}')
+                if in_bag_count[bag.name, item.name] > 0:
+                    print(f'{item.name}: {in_bag_count[bag.name, item.name]}')
             print()
 
         print('\n=== Total items ===')
         for item in items:
-            if base.vars[item.name]["count"].x > 0:
-                print(f'{item.name}: {base.vars[item.name]["count"].x}')
+            if item_count[item.name] > 0:
+                print(f'{item.name}: {item_count[item.name]}')
 
 